@@ -0,0 +1,226 @@
+"""
+Streaming export and import of the whole song library.
+
+The archive is a plain tar stream:
+
+    manifest.json                 format version, export time, song count
+    songs/000001.json             title, created_at, content_hash, compression, source_id
+    songs/000001.mp3.zlib         the stored BLOB, exactly as in youtube_audio
+    songs/000002.json
+    ...
+
+Only one song is held in memory at a time on either side. Import verifies each
+song against its content hash and skips songs whose hash is already present,
+so re-running an interrupted import simply continues where it stopped.
+
+    python library_archive.py export library.tar
+    python library_archive.py import library.tar
+
+Uses the same database as the API (NMUSIC_DB_PATH / TURSO_DB_URL).
+"""
+import io
+import sys
+import json
+import time
+import zlib
+import hashlib
+import tarfile
+import argparse
+
+ARCHIVE_FORMAT = 1
+SONG_COLUMNS = "title, audio_data, content_hash, compression, source_id, created_at"
+
+
+class _ChunkSink:
+    """Write-only file object that collects what tarfile writes so it can be yielded."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return b"".join(chunks)
+
+
+def _add_member(tar, name, data, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    tar.addfile(info, io.BytesIO(data))
+
+
+def iter_export(conn, store_hash=False):
+    """
+    Yields the library as tar bytes, reading one song per query. Rows without a
+    content hash get one computed on the fly (and stored if store_hash is set).
+    """
+    song_ids = [row[0] for row in conn.execute("SELECT id FROM youtube_audio ORDER BY id").fetchall()]
+    sink = _ChunkSink()
+    now = int(time.time())
+    with tarfile.open(fileobj=sink, mode="w|") as tar:
+        manifest = {"format": ARCHIVE_FORMAT, "exported_at": now, "song_count": len(song_ids)}
+        _add_member(tar, "manifest.json", json.dumps(manifest).encode(), now)
+        for position, song_id in enumerate(song_ids, start=1):
+            # fetchall() finalizes the statement so no read lock outlives the song
+            rows = conn.execute(
+                "SELECT title, content_hash, compression, source_id, created_at, audio_data FROM youtube_audio WHERE id = ?",
+                (song_id,)
+            ).fetchall()
+            if not rows:
+                continue  # deleted while exporting
+            title, content_hash, compression, source_id, created_at, compressed_audio = rows[0]
+            if not content_hash:
+                content_hash = hashlib.sha256(zlib.decompress(compressed_audio)).hexdigest()
+                if store_hash:
+                    conn.execute("UPDATE youtube_audio SET content_hash = ? WHERE id = ?", (content_hash, song_id))
+                    conn.commit()
+            meta = {
+                "title": title, "created_at": created_at, "content_hash": content_hash,
+                "compression": compression, "source_id": source_id,
+            }
+            _add_member(tar, f"songs/{position:06d}.json", json.dumps(meta).encode(), now)
+            _add_member(tar, f"songs/{position:06d}.mp3.zlib", compressed_audio, now)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_archive_songs(fileobj):
+    """
+    Reads a tar stream sequentially and yields (meta, compressed_audio) per song,
+    raising ValueError for a song whose data doesn't match its content hash.
+    """
+    meta = None
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            data = tar.extractfile(member).read()
+            if member.name == "manifest.json":
+                manifest = json.loads(data)
+                if manifest.get("format") != ARCHIVE_FORMAT:
+                    raise ValueError(f"Unsupported archive format: {manifest.get('format')}")
+            elif member.name.endswith(".json"):
+                meta = json.loads(data)
+            elif member.name.endswith(".mp3.zlib"):
+                if meta is None:
+                    raise ValueError(f"{member.name} has no metadata entry")
+                if hashlib.sha256(zlib.decompress(data)).hexdigest() != meta["content_hash"]:
+                    raise ValueError(f"Content hash mismatch for '{meta['title']}'")
+                yield meta, data
+                meta = None
+
+
+def ensure_library_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS youtube_audio (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            audio_data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            content_hash TEXT,
+            compression TEXT,
+            source_id TEXT
+        )
+    """)
+    conn.commit()
+
+
+def backfill_hashes(conn, batch=20, pause=0.0, progress=None, stop=None):
+    """
+    Stores content_hash for rows that have none (written before the column
+    existed), so duplicate checks by hash see every song. Walks the table by id,
+    committing per batch; a corrupt row is reported and passed over. Setting the
+    optional stop event ends the walk after the current batch. Returns the number
+    of rows visited.
+    """
+    done = last_id = 0
+    while not (stop and stop.is_set()):
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM youtube_audio WHERE content_hash IS NULL AND id > ? ORDER BY id LIMIT ?",
+            (last_id, batch)
+        ).fetchall()]
+        if not ids:
+            return done
+        for song_id in ids:
+            compressed_audio = conn.execute("SELECT audio_data FROM youtube_audio WHERE id = ?", (song_id,)).fetchall()[0][0]
+            try:
+                content_hash = hashlib.sha256(zlib.decompress(compressed_audio)).hexdigest()
+            except zlib.error as e:
+                print(f"Skipping song {song_id}: stored audio is corrupt ({e})", file=sys.stderr)
+                continue
+            conn.execute("UPDATE youtube_audio SET content_hash = ? WHERE id = ?", (content_hash, song_id))
+        conn.commit()
+        last_id = ids[-1]
+        done += len(ids)
+        if progress:
+            progress(done)
+        time.sleep(pause)
+    return done
+
+
+def import_song(conn, meta, compressed_audio):
+    """
+    Inserts one song unless its content hash is already in the library. Run
+    backfill_hashes first, or unhashed rows can't be recognised as duplicates.
+    """
+    existing = conn.execute(
+        "SELECT id FROM youtube_audio WHERE content_hash = ? LIMIT 1",
+        (meta["content_hash"],)
+    ).fetchall()
+    if existing:
+        return False
+    conn.execute(
+        f"INSERT INTO youtube_audio ({SONG_COLUMNS}) VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+        (meta["title"], compressed_audio, meta["content_hash"], meta.get("compression"),
+         meta.get("source_id"), meta.get("created_at"))
+    )
+    # Commit per song: an interrupted import keeps everything up to here
+    conn.commit()
+    return True
+
+
+def import_archive(conn, fileobj, progress=None):
+    backfill_hashes(conn)
+    summary = {"imported": 0, "skipped": 0}
+    for meta, compressed_audio in iter_archive_songs(fileobj):
+        imported = import_song(conn, meta, compressed_audio)
+        summary["imported" if imported else "skipped"] += 1
+        if progress:
+            progress(meta, imported)
+    return summary
+
+
+def main():
+    from nmusicapi import get_db_connection, ensure_audio_schema
+
+    parser = argparse.ArgumentParser(description="Export or import the NMusic library as a tar stream")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="archive file, or - for stdout/stdin")
+    args = parser.parse_args()
+
+    with get_db_connection() as conn:
+        if args.command == "export":
+            out = sys.stdout.buffer if args.path == "-" else open(args.path, "wb")
+            with out:
+                for chunk in iter_export(conn, store_hash=True):
+                    out.write(chunk)
+            print("Export complete.", file=sys.stderr)
+        else:
+            ensure_library_table(conn)
+            ensure_audio_schema(conn)
+            source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+
+            def progress(meta, imported):
+                print(f"{'Imported' if imported else 'Skipped '} {meta['title']}", file=sys.stderr)
+
+            with source:
+                summary = import_archive(conn, source, progress)
+            print(f"Import complete: {summary['imported']} imported, {summary['skipped']} already present.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Load-test harness for nmusicapi.py.
+
+Builds a synthetic song database, starts the API with uvicorn against it (no
+Turso, fully offline) and simulates concurrent listeners doing a realistic mix
+of /playlist, /queue/* and partial /play and /audio reads. For each concurrency
+level it reports requests/sec, p50/p95/p99 latency, error rate, the share of
+requests shed with 503 by admission control and server RSS, then measures
+/queue/events broadcast latency with many SSE subscribers.
+
+Usage:
+    python loadtest.py --levels 1,10,50,100 --duration 20 --subscribers 100,500
+
+Requires httpx in addition to the API's own requirements.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import sqlite3
+from collections import Counter
+
+try:
+    import httpx
+except ImportError:
+    print("ERROR: the load test needs httpx (pip install httpx).")
+    sys.exit(1)
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+WORDS = ["love", "night", "summer", "river", "fire", "dream", "city", "heart", "rain", "gold",
+         "echo", "neon", "wild", "blue", "ocean", "road", "light", "shadow", "moon", "storm"]
+
+# (weight, action) - roughly what a listener does in the PWA
+LISTENER_MIX = [
+    (10, "playlist"),
+    (25, "queue"),
+    (20, "queue_add"),
+    (10, "queue_remove"),
+    (5, "queue_move"),
+    (20, "play_partial"),
+    (10, "audio_range"),
+]
+PARTIAL_READ_BYTES = 256 * 1024  # listeners often skip before a song finishes
+
+
+def build_database(path, songs, song_kb):
+    """Creates a youtube_audio table filled with random, compressible 'audio'."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS youtube_audio (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            audio_data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    titles = []
+    for i in range(songs):
+        title = f"{' '.join(random.sample(WORDS, 3)).title()} {i}"
+        # Half random, half repeated bytes compresses roughly like real MP3 frames
+        raw = os.urandom(song_kb * 512) + bytes(song_kb * 512)
+        conn.execute("INSERT INTO youtube_audio (title, audio_data) VALUES (?, ?)", (title, zlib.compress(raw)))
+        titles.append(title)
+    conn.commit()
+    conn.close()
+    return titles
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_rss_mb(pid):
+    """Resident set size of the server process, or None if it can't be read."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def start_server(db_path, port):
+    env = {**os.environ, "NMUSIC_DB_PATH": db_path, "TURSO_DB_URL": "", "TURSO_AUTH_TOKEN": ""}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "nmusicapi:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR, env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("API server did not start within 30s")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = Counter()
+        self.shed = 0
+        self.requests = 0
+
+    def record(self, action, started, outcome):
+        self.requests += 1
+        self.latencies.append(time.perf_counter() - started)
+        if outcome == "shed":
+            self.shed += 1
+        elif outcome != "ok":
+            self.errors[action] += 1
+
+
+def outcome(response, *ok_statuses):
+    """'ok', 'shed' (503 from admission control) or 'error'."""
+    if response.status_code in ok_statuses:
+        return "ok"
+    return "shed" if response.status_code == 503 else "error"
+
+
+async def listener(client, titles, stats, stop_at, think_time):
+    """One simulated listener looping over weighted actions until stop_at."""
+    weights, actions = zip(*LISTENER_MIX)
+    my_queue_ids = []
+    while time.perf_counter() < stop_at:
+        action = random.choices(actions, weights)[0]
+        started = time.perf_counter()
+        try:
+            if action == "playlist":
+                result = outcome(await client.get("/playlist"), 200)
+            elif action == "queue":
+                result = outcome(await client.get("/queue"), 200)
+            elif action == "queue_add":
+                response = await client.post("/queue/add", json={"name": random.choice(titles)})
+                result = outcome(response, 200)
+                if result == "ok":
+                    my_queue_ids.append(response.json()["id"])
+            elif action == "queue_remove" and my_queue_ids:
+                song_id = my_queue_ids.pop(random.randrange(len(my_queue_ids)))
+                # Another listener may have cleared it already; 404 is expected then
+                result = outcome(await client.delete(f"/queue/{song_id}"), 200, 404)
+            elif action == "queue_move" and my_queue_ids:
+                response = await client.post("/queue/batch", json={"operations": [
+                    {"op": "move", "id": random.choice(my_queue_ids), "index": 0}
+                ]})
+                result = outcome(response, 200, 404)
+            elif action == "play_partial":
+                async with client.stream("GET", f"/play/{random.choice(titles)}") as response:
+                    result = outcome(response, 200)
+                    received = 0
+                    async for chunk in response.aiter_bytes():
+                        received += len(chunk)
+                        if received >= PARTIAL_READ_BYTES:
+                            break
+            elif action == "audio_range":
+                song_id = random.randint(1, len(titles))
+                response = await client.get(f"/audio/{song_id}", headers={"Range": f"bytes=0-{PARTIAL_READ_BYTES - 1}"})
+                result = outcome(response, 200, 206)
+            else:
+                continue
+        except httpx.HTTPError:
+            result = "error"
+        stats.record(action, started, result)
+        if think_time:
+            await asyncio.sleep(random.expovariate(1 / think_time))
+
+
+async def run_level(base_url, titles, concurrency, duration, think_time, pid):
+    stats = Stats()
+    rss_samples = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        stop_at = time.perf_counter() + duration
+
+        async def sample_rss():
+            while time.perf_counter() < stop_at:
+                rss = server_rss_mb(pid)
+                if rss is not None:
+                    rss_samples.append(rss)
+                await asyncio.sleep(0.5)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            sample_rss(),
+            *(listener(client, titles, stats, stop_at, think_time) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(stats.latencies)
+    errors = sum(stats.errors.values())
+    return {
+        "concurrency": concurrency,
+        "requests": stats.requests,
+        "rps": round(stats.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "error_rate": round(errors / stats.requests, 4) if stats.requests else 0.0,
+        "shed_rate": round(stats.shed / stats.requests, 4) if stats.requests else 0.0,
+        "errors": dict(stats.errors),
+        "rss_mb": round(max(rss_samples), 1) if rss_samples else None,
+    }
+
+
+async def measure_broadcast(base_url, titles, subscribers, events):
+    """
+    Opens `subscribers` /queue/events streams, performs `events` queue adds and
+    records how long each change takes to reach every subscriber.
+    """
+    limits = httpx.Limits(max_connections=subscribers + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        sent_at = {}
+        arrivals = []  # (queue entry id, arrival time) per subscriber per event
+        ready = asyncio.Event()
+        connected = 0
+
+        async def subscribe():
+            nonlocal connected
+            received = 0
+            async with client.stream("GET", "/queue/events") as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event["type"] == "snapshot":
+                        connected += 1
+                        if connected == subscribers:
+                            ready.set()
+                        continue
+                    if event["type"] == "add":
+                        arrivals.append((event["song"]["id"], time.perf_counter()))
+                        received += 1
+                        if received == events:
+                            return
+
+        tasks = [asyncio.create_task(subscribe()) for _ in range(subscribers)]
+        await asyncio.wait_for(ready.wait(), timeout=60)
+        await client.post("/queue/clear")
+        for _ in range(events):
+            started = time.perf_counter()
+            response = await client.post("/queue/add", json={"name": random.choice(titles)})
+            # The event is published before the response arrives, so latency is
+            # measured from the moment the request was sent
+            sent_at[response.json()["id"]] = started
+            await asyncio.sleep(0.05)
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+
+    latencies = sorted(arrived - sent_at[song_id] for song_id, arrived in arrivals)
+    return {
+        "subscribers": subscribers,
+        "deliveries": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def print_table(rows, columns):
+    print("  ".join(f"{column:>12}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{str(row[column]):>12}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the NMusic API")
+    parser.add_argument("--levels", default="1,10,50", help="comma-separated listener counts ('' for the broadcast test only)")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per concurrency level")
+    parser.add_argument("--songs", type=int, default=50, help="songs in the synthetic database")
+    parser.add_argument("--song-kb", type=int, default=1024, help="uncompressed size of each song")
+    parser.add_argument("--think-time", type=float, default=0.2, help="mean pause between a listener's requests")
+    parser.add_argument("--subscribers", default="100,300", help="SSE subscriber counts for the broadcast test ('' to skip)")
+    parser.add_argument("--events", type=int, default=20, help="queue changes per broadcast measurement")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "loadtest.db")
+        print(f"Building synthetic database with {args.songs} songs of {args.song_kb} KB...")
+        titles = build_database(db_path, args.songs, args.song_kb)
+        process, base_url = start_server(db_path, free_port())
+        try:
+            results = []
+            for concurrency in [int(level) for level in args.levels.split(",") if level]:
+                print(f"Running {concurrency} listeners for {args.duration}s...")
+                results.append(asyncio.run(run_level(base_url, titles, concurrency, args.duration, args.think_time, process.pid)))
+
+            broadcast = []
+            for subscribers in [int(n) for n in args.subscribers.split(",") if n]:
+                print(f"Measuring queue broadcast latency with {subscribers} subscribers...")
+                broadcast.append(asyncio.run(measure_broadcast(base_url, titles, subscribers, args.events)))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps({"levels": results, "broadcast": broadcast}, indent=2))
+        return
+    if results:
+        print()
+        print_table(results, ["concurrency", "requests", "rps", "p50_ms", "p95_ms", "p99_ms", "error_rate", "shed_rate", "rss_mb"])
+        for row in results:
+            if row["errors"]:
+                print(f"  errors at {row['concurrency']} listeners: {row['errors']}")
+    if broadcast:
+        print()
+        print_table(broadcast, ["subscribers", "deliveries", "p50_ms", "p99_ms", "max_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Storage maintenance for the youtube_audio table.
+
+    python maintenance.py report               # per-song and total storage
+    python maintenance.py dedupe [--titles]    # merge duplicate content (and titles)
+    python maintenance.py recompress           # rewrite rows at the configured zlib level
+    python maintenance.py vacuum               # return free pages to the filesystem
+    python maintenance.py all                  # dedupe, recompress, vacuum
+
+Every step works in small batches with a commit (and an optional pause) after
+each one, so the API keeps serving reads while it runs and an interrupted run
+simply picks up where it stopped next time.
+
+Uses the same database as the API (NMUSIC_DB_PATH / TURSO_DB_URL).
+"""
+import os
+import sys
+import time
+import zlib
+import argparse
+
+import library_archive
+from nmusicapi import get_db_connection, ensure_audio_schema
+
+# Audio is stored zlib-compressed everywhere; this is the level rows are
+# rewritten at. The label is recorded per row so recompression is resumable.
+ZLIB_LEVEL = int(os.environ.get("NMUSIC_ZLIB_LEVEL", "9"))
+
+
+def compression_label(level):
+    return f"zlib-{level}"
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def report(conn, args):
+    """Prints every song's stored size, then totals and free space in the file."""
+    rows = conn.execute(
+        "SELECT id, title, length(audio_data), compression, content_hash FROM youtube_audio ORDER BY length(audio_data) DESC"
+    ).fetchall()
+    print(f"{'id':>6}  {'size':>10}  {'compression':<12}  title")
+    for song_id, title, size, compression, _ in rows:
+        print(f"{song_id:>6}  {format_size(size):>10}  {compression or 'unknown':<12}  {title}")
+
+    total = sum(row[2] for row in rows)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    duplicate_content = conn.execute(
+        "SELECT COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM youtube_audio WHERE content_hash IS NOT NULL GROUP BY content_hash)"
+    ).fetchone()[0]
+    duplicate_titles = conn.execute(
+        "SELECT COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM youtube_audio GROUP BY title)"
+    ).fetchone()[0]
+    pending = conn.execute(
+        "SELECT COUNT(*) FROM youtube_audio WHERE compression IS NULL OR compression != ?",
+        (compression_label(args.level),)
+    ).fetchone()[0]
+    unhashed = sum(1 for row in rows if not row[4])
+
+    print(f"\nSongs: {len(rows)}, audio: {format_size(total)}")
+    print(f"Database file: {format_size(page_count * page_size)}, free: {format_size(free_pages * page_size)}")
+    print(f"Duplicate rows by content: {duplicate_content} (unhashed rows: {unhashed}), by title: {duplicate_titles}")
+    print(f"Rows not yet at {compression_label(args.level)}: {pending}")
+
+
+def backfill_hashes(conn, args):
+    """Computes content_hash for rows written before the column existed."""
+    library_archive.backfill_hashes(
+        conn, args.batch, args.pause,
+        progress=lambda done: print(f"Hashed {done} rows...")
+    )
+
+
+def delete_duplicates(conn, args, group_column):
+    """
+    Deletes all but the newest row of each group sharing group_column. The newest
+    row is what /play and /playlist already serve, so their results don't change.
+    When the rows share content_hash, each deleted id becomes an alias of the row
+    that was kept (as do aliases that pointed at it), so /audio/{id} URLs and
+    queued songs keep resolving to the same audio. Rows merged by title may be
+    different recordings, and /audio/{id} is cached as immutable, so those ids
+    (and aliases of them) are dropped and return 404 instead.
+    """
+    removed = 0
+    while True:
+        rows = conn.execute(
+            f"""
+            SELECT a.id, (SELECT MAX(b.id) FROM youtube_audio b WHERE b.{group_column} = a.{group_column}) AS kept_id
+            FROM youtube_audio a
+            WHERE a.{group_column} IS NOT NULL
+              AND a.id < (SELECT MAX(b.id) FROM youtube_audio b WHERE b.{group_column} = a.{group_column})
+            LIMIT ?
+            """,
+            (args.batch,)
+        ).fetchall()
+        if not rows:
+            break
+        ids = [row[0] for row in rows]
+        placeholders = ", ".join("?" for _ in ids)
+        if group_column == "content_hash":
+            for song_id, kept_id in rows:
+                conn.execute("UPDATE youtube_audio_alias SET song_id = ? WHERE song_id = ?", (kept_id, song_id))
+                conn.execute(
+                    "INSERT OR REPLACE INTO youtube_audio_alias (alias_id, song_id) VALUES (?, ?)",
+                    (song_id, kept_id)
+                )
+        else:
+            conn.execute(f"DELETE FROM youtube_audio_alias WHERE song_id IN ({placeholders})", tuple(ids))
+        conn.execute(f"DELETE FROM youtube_audio WHERE id IN ({placeholders})", tuple(ids))
+        conn.commit()
+        removed += len(ids)
+        print(f"Removed {removed} duplicate rows by {group_column}...")
+        time.sleep(args.pause)
+    return removed
+
+
+def dedupe(conn, args):
+    backfill_hashes(conn, args)
+    removed = delete_duplicates(conn, args, "content_hash")
+    if args.titles:
+        removed += delete_duplicates(conn, args, "title")
+    print(f"Dedupe finished: {removed} rows removed.")
+
+
+def recompress(conn, args):
+    """
+    Rewrites rows whose compression label differs from the target level, one
+    batch per transaction. Rows are always labelled once processed, even when
+    recompressing didn't shrink them, so they aren't revisited. A corrupt row is
+    reported and left as it is.
+    """
+    label = compression_label(args.level)
+    processed = saved = last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, audio_data FROM youtube_audio WHERE id > ? AND (compression IS NULL OR compression != ?) ORDER BY id LIMIT ?",
+            (last_id, label, args.batch)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for song_id, compressed_audio in rows:
+            try:
+                recompressed = zlib.compress(zlib.decompress(compressed_audio), args.level)
+            except zlib.error as e:
+                print(f"Skipping song {song_id}: stored audio is corrupt ({e})", file=sys.stderr)
+                continue
+            if len(recompressed) < len(compressed_audio):
+                conn.execute(
+                    "UPDATE youtube_audio SET audio_data = ?, compression = ? WHERE id = ?",
+                    (recompressed, label, song_id)
+                )
+                saved += len(compressed_audio) - len(recompressed)
+            else:
+                conn.execute("UPDATE youtube_audio SET compression = ? WHERE id = ?", (label, song_id))
+        conn.commit()
+        processed += len(rows)
+        print(f"Recompressed {processed} rows, saved {format_size(saved)} so far...")
+        time.sleep(args.pause)
+    print(f"Recompress finished: {processed} rows, {format_size(saved)} saved.")
+
+
+def vacuum(conn, args):
+    """
+    Frees pages with PRAGMA incremental_vacuum a few at a time. Incremental mode
+    has to be switched on once with a full VACUUM (--enable), which does block
+    writers for its duration.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if not args.enable:
+            print("Incremental vacuum is not enabled on this database. Run 'vacuum --enable' once "
+                  "(performs a full VACUUM) during a quiet period.")
+            return
+        print("Enabling incremental auto_vacuum (full VACUUM)...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    initial_free = free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free_pages:
+        # executescript: libsql's execute() rejects PRAGMAs that step through rows
+        conn.executescript(f"PRAGMA incremental_vacuum({args.vacuum_pages});")
+        conn.commit()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free_pages:
+            break  # nothing more can be released right now
+        free_pages = remaining
+        time.sleep(args.pause)
+    freed = initial_free - free_pages
+    print(f"Vacuum finished: {format_size(freed * page_size)} returned to the filesystem.")
+
+
+def run_all(conn, args):
+    dedupe(conn, args)
+    recompress(conn, args)
+    vacuum(conn, args)
+
+
+COMMANDS = {"report": report, "dedupe": dedupe, "recompress": recompress, "vacuum": vacuum, "all": run_all}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NMusic storage maintenance")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("--titles", action="store_true", help="dedupe: also merge rows that share a title")
+    parser.add_argument("--enable", action="store_true", help="vacuum: switch the database to incremental auto_vacuum")
+    parser.add_argument("--level", type=int, default=ZLIB_LEVEL, help="zlib level to recompress to")
+    parser.add_argument("--batch", type=int, default=20, help="rows per transaction")
+    parser.add_argument("--vacuum-pages", type=int, default=2000, help="pages freed per incremental_vacuum step")
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds to pause between batches")
+    args = parser.parse_args()
+
+    try:
+        with get_db_connection() as conn:
+            ensure_audio_schema(conn)
+            COMMANDS[args.command](conn, args)
+    except KeyboardInterrupt:
+        print("\nInterrupted; completed batches are kept and the next run resumes from there.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,49 @@
+import io
 import os
+import re
 import sys
+import queue
+import threading
+import concurrent.futures
+import json
+import asyncio
 import zlib
+import time
+import hashlib
 import libsql
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal, Set
+from collections import OrderedDict
 import tempfile
 from contextlib import asynccontextmanager
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartParser, MultiPartException
 from uuid import uuid4
 from urllib.parse import quote
 from fastapi.middleware.cors import CORSMiddleware # Import CORSMiddleware
+from library_archive import iter_export, iter_archive_songs, import_song, ensure_library_table, backfill_hashes
 
 # --- TURSO DATABASE CONFIGURATION ---
 TURSO_DB_URL = os.environ.get("TURSO_DB_URL", "")
 TURSO_AUTH_TOKEN = os.environ.get("TURSO_AUTH_TOKEN", "")
+# Local embedded-replica file; point it elsewhere to run against a test database
+DB_PATH = os.environ.get("NMUSIC_DB_PATH", "nmusic.db")
+
+def get_db_connection():
+    """
+    Opens the embedded replica synced with Turso, or a plain local database when
+    no TURSO_DB_URL is set (offline development and load testing).
+    """
+    if TURSO_DB_URL:
+        return libsql.connect(DB_PATH, sync_url=TURSO_DB_URL, auth_token=TURSO_AUTH_TOKEN)
+    return libsql.connect(DB_PATH)
+
+# Bulk/admin endpoints (library export and import) are disabled unless this is
+# set, and then require it as a bearer token
+ADMIN_TOKEN = os.environ.get("NMUSIC_ADMIN_TOKEN", "")
 
 # List to track temporary files for cleanup
 temp_files = []
@@ -25,11 +54,622 @@ temp_files = []
 # For a real app, you would want to store this queue data in your Turso database.
 queues: Dict[str, List[Dict[str, str]]] = {} # Storing dicts with id and name now
 
+# --- QUEUE CHANGE FEED ---
+# Every mutation bumps queue_version and is pushed to each /queue/events
+# subscriber's asyncio.Queue, so clients stay in sync without refetching.
+QUEUE_EVENT_BUFFER = 256
+QUEUE_EVENT_KEEPALIVE = 15  # seconds between SSE keep-alive comments
+queue_version = 0
+queue_subscribers: Set[asyncio.Queue] = set()
+
+# Audio served from /audio/{song_id} never changes for a given row, so clients,
+# the service worker and any CDN may keep it for a year without revalidating.
+AUDIO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+RANGE_HEADER_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Decompressed audio kept in memory (LRU, bounded by bytes) so hot tracks skip
+# the BLOB read and zlib inflate. Filled by /audio and primed by /warmup.
+AUDIO_CACHE_BYTES = int(os.environ.get("NMUSIC_AUDIO_CACHE_MB", "64")) * 1024 * 1024
+WARMUP_TRACKS = int(os.environ.get("NMUSIC_WARMUP_TRACKS", "5"))
+audio_cache: "OrderedDict[int, tuple]" = OrderedDict() # song_id -> (title, content_hash, audio)
+audio_cache_bytes = 0
+
+# The NMUSIC_PREFETCH_TRACKS queued songs after the one being played are loaded
+# into audio_cache in the background so /play and /audio start instantly.
+# Prefetched songs that haven't been played yet may use at most NMUSIC_PREFETCH_MB
+# of the cache.
+PREFETCH_TRACKS = int(os.environ.get("NMUSIC_PREFETCH_TRACKS", "3"))
+PREFETCH_BUDGET_BYTES = int(os.environ.get("NMUSIC_PREFETCH_MB", "32")) * 1024 * 1024
+prefetch_tasks: Dict[int, asyncio.Task] = {}
+prefetched_ids: Set[int] = set() # cached by the prefetcher and not played yet
+now_playing_id: Optional[str] = None # queue entry id the listener is on
+
+# --- ADMISSION CONTROL ---
+# Each endpoint class has a concurrency limit and a memory budget. Requests over
+# either are shed at once with 503 + Retry-After instead of piling up until the
+# instance runs out of memory. Ingest also backs off whenever playback is busy.
+PLAY_MAX_CONCURRENT = int(os.environ.get("NMUSIC_PLAY_MAX_CONCURRENT", "8"))
+PLAY_MEMORY_BYTES = int(os.environ.get("NMUSIC_PLAY_MEMORY_MB", "256")) * 1024 * 1024
+INGEST_MAX_CONCURRENT = int(os.environ.get("NMUSIC_INGEST_MAX_CONCURRENT", "2"))
+INGEST_MEMORY_BYTES = int(os.environ.get("NMUSIC_INGEST_MEMORY_MB", "64")) * 1024 * 1024
+RETRY_AFTER_SECONDS = int(os.environ.get("NMUSIC_RETRY_AFTER", "5"))
+BUSY_RATIO = 0.5 # share of playback capacity above which ingest is refused
+
+class AdmissionTicket:
+    """
+    One admitted request. Memory is reserved against the limiter as it becomes
+    known, and everything is given back once the response has been sent.
+    """
+
+    def __init__(self, limiter: "AdmissionLimiter"):
+        self.limiter = limiter
+        self.reserved = 0
+        self.released = False
+        self.handed_off = False
+
+    def reserve(self, nbytes: int):
+        if self.limiter.reserved_bytes + nbytes > self.limiter.memory_budget:
+            self.release()
+            self.limiter.reject("memory budget exhausted")
+        self.limiter.reserved_bytes += nbytes
+        self.reserved += nbytes
+
+    def reserve_peak(self, nbytes: int):
+        """For work that holds one item at a time: grow the reservation to the largest seen."""
+        if nbytes > self.reserved:
+            self.reserve(nbytes - self.reserved)
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.limiter.in_flight -= 1
+        self.limiter.reserved_bytes -= self.reserved
+
+    def release_after(self, response: Response) -> Response:
+        """Keeps the slot until the response body has gone out."""
+        response.background = BackgroundTask(self.release)
+        self.handed_off = True
+        return response
+
+    def release_when_done(self, body):
+        """
+        Wraps an async response body so the slot is freed when it ends, fails or
+        is cancelled; Starlette skips background tasks when streaming fails.
+        """
+        self.handed_off = True
+        async def guarded():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                self.release()
+        return guarded()
+
+    def close(self):
+        # For finally blocks: free the slot unless a response now owns it
+        if not self.handed_off:
+            self.release()
+
+class AdmissionLimiter:
+    """Non-blocking concurrency and memory limiter for one class of endpoints."""
+
+    def __init__(self, name: str, max_concurrent: int, memory_budget: int, yields_to: Optional["AdmissionLimiter"] = None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.memory_budget = memory_budget
+        self.yields_to = yields_to
+        self.in_flight = 0
+        self.reserved_bytes = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def busy(self) -> bool:
+        return (self.in_flight >= self.max_concurrent * BUSY_RATIO
+                or self.reserved_bytes >= self.memory_budget * BUSY_RATIO)
+
+    def reject(self, reason: str):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({self.name}: {reason}), please retry",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+    def acquire(self) -> AdmissionTicket:
+        """Admits one request or raises 503 with Retry-After."""
+        if self.in_flight >= self.max_concurrent:
+            self.reject("too many concurrent requests")
+        if self.yields_to and self.yields_to.busy():
+            self.reject(f"{self.yields_to.name} has priority")
+        self.in_flight += 1
+        self.admitted += 1
+        return AdmissionTicket(self)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "reserved_bytes": self.reserved_bytes,
+            "memory_budget": self.memory_budget,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+playback_limiter = AdmissionLimiter("playback", PLAY_MAX_CONCURRENT, PLAY_MEMORY_BYTES)
+ingest_limiter = AdmissionLimiter("ingest", INGEST_MAX_CONCURRENT, INGEST_MEMORY_BYTES, yields_to=playback_limiter)
+
+# Uploads: larger bodies are refused with 413 as soon as the limit is crossed.
+# Storing one needs twice its size in memory (see AudioSpool.read), so the limit
+# never exceeds half the ingest budget; raise NMUSIC_INGEST_MEMORY_MB for long mixes.
+UPLOAD_MAX_BYTES = min(int(os.environ.get("NMUSIC_UPLOAD_MAX_MB", "256")) * 1024 * 1024, INGEST_MEMORY_BYTES // 2)
+UPLOAD_ZLIB_LEVEL = int(os.environ.get("NMUSIC_ZLIB_LEVEL", "9"))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+# Pause between batches of the startup hash backfill, so it never competes
+# with listeners for long
+HASH_BACKFILL_PAUSE = float(os.environ.get("NMUSIC_HASH_BACKFILL_PAUSE", "0.5"))
+
+PROCESS_STARTED = time.time()
+warmed_up = False
+# A /warmup arriving within this many seconds of process start is counted as a
+# cold start: the instance was (re)started for, or just before, that request
+COLD_START_SECONDS = float(os.environ.get("NMUSIC_COLD_START_SECONDS", "60"))
+
+def ensure_audio_schema(conn):
+    """
+    Adds the content_hash column (sha256 of the decompressed audio), the
+    compression label written by maintenance.py and the source video id that
+    playlist syncs in app.py skip by to older databases. New rows get their
+    hash when they are inserted (app.py, /upload, imports); rows written before
+    that are backfilled in the background at startup, by /warmup and by
+    maintenance.py, never by /audio.
+    """
+    # Ids of rows merged away by maintenance.py dedupe, pointing at the row that
+    # was kept, so /audio URLs handed out earlier keep working
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS youtube_audio_alias (
+            alias_id INTEGER PRIMARY KEY,
+            song_id INTEGER NOT NULL
+        )
+    """)
+    conn.commit()
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(youtube_audio)").fetchall()]
+    if not columns:
+        return
+    if "content_hash" not in columns:
+        conn.execute("ALTER TABLE youtube_audio ADD COLUMN content_hash TEXT")
+    if "compression" not in columns:
+        conn.execute("ALTER TABLE youtube_audio ADD COLUMN compression TEXT")
+    if "source_id" not in columns:
+        conn.execute("ALTER TABLE youtube_audio ADD COLUMN source_id TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_youtube_audio_content_hash ON youtube_audio (content_hash)")
+    conn.commit()
+
+# Matches a song by its id or by an alias left behind by dedupe
+SONG_ID_MATCH = "id = COALESCE((SELECT song_id FROM youtube_audio_alias WHERE alias_id = ?), ?)"
+
+def load_song_audio(conn, song_id: int, store_hash: bool = True):
+    """
+    Reads and decompresses one song. Returns (title, content_hash, audio) or None,
+    computing the content hash for rows written before the column existed and
+    storing it unless store_hash is False.
+    """
+    row = conn.execute(
+        f"SELECT id, title, content_hash, audio_data FROM youtube_audio WHERE {SONG_ID_MATCH}",
+        (song_id, song_id)
+    ).fetchone()
+    if not row:
+        return None
+    song_id, title, content_hash, compressed_audio = row
+    audio = zlib.decompress(compressed_audio)
+    if not content_hash:
+        content_hash = hashlib.sha256(audio).hexdigest()
+        if not store_hash:
+            return title, content_hash, audio
+        try:
+            conn.execute(
+                "UPDATE youtube_audio SET content_hash = ? WHERE id = ?",
+                (content_hash, song_id)
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"Could not store content hash for song {song_id}: {e}")
+    return title, content_hash, audio
+
+def audio_cache_get(song_id: int):
+    entry = audio_cache.get(song_id)
+    if entry:
+        audio_cache.move_to_end(song_id)
+        # A played prefetch becomes an ordinary cache entry
+        prefetched_ids.discard(song_id)
+    return entry
+
+def audio_cache_discard(song_id: int):
+    global audio_cache_bytes
+    entry = audio_cache.pop(song_id, None)
+    if entry:
+        audio_cache_bytes -= len(entry[2])
+
+def audio_cache_put(song_id: int, title: str, content_hash: str, audio: bytes):
+    global audio_cache_bytes
+    if len(audio) > AUDIO_CACHE_BYTES or song_id in audio_cache:
+        return
+    audio_cache[song_id] = (title, content_hash, audio)
+    audio_cache_bytes += len(audio)
+    while audio_cache_bytes > AUDIO_CACHE_BYTES:
+        evicted_id, (_, _, evicted) = audio_cache.popitem(last=False)
+        audio_cache_bytes -= len(evicted)
+        prefetched_ids.discard(evicted_id)
+
+def fetch_song_audio(song_id: int):
+    """
+    load_song_audio on its own connection, for use from a worker thread. It stays
+    read-only: a write from here would wait on the event loop's read locks and
+    stall every request. Missing hashes are written elsewhere; see
+    ensure_audio_schema.
+    """
+    with get_db_connection() as conn:
+        return load_song_audio(conn, song_id, store_hash=False)
+
+async def prefetch_song(song_id: int):
+    try:
+        song = await asyncio.to_thread(fetch_song_audio, song_id)
+        if not song or song_id in audio_cache:
+            return
+        prefetched_bytes = sum(len(audio_cache[i][2]) for i in prefetched_ids if i in audio_cache)
+        if prefetched_bytes + len(song[2]) > PREFETCH_BUDGET_BYTES:
+            return
+        audio_cache_put(song_id, *song)
+        if song_id in audio_cache:
+            prefetched_ids.add(song_id)
+    except Exception as e:
+        print(f"Prefetch of song {song_id} failed: {e}")
+    finally:
+        prefetch_tasks.pop(song_id, None)
+
+def follow_playback(song_id: int):
+    """
+    Moves now_playing_id to the next queue entry holding a song that was just
+    requested, for listeners that don't report their position themselves.
+    Repeated requests for the current song (Range requests) change nothing.
+    """
+    global now_playing_id
+    queue = queues.get(GLOBAL_QUEUE_ID, [])
+    current = next((i for i, song in enumerate(queue) if song["id"] == now_playing_id), -1)
+    if current >= 0 and queue[current].get("song_id") == song_id:
+        return
+    for offset in range(1, len(queue) + 1):
+        entry = queue[(current + offset) % len(queue)]
+        if entry.get("song_id") == song_id:
+            now_playing_id = entry["id"]
+            schedule_prefetch()
+            return
+
+def schedule_prefetch():
+    """
+    Lines the prefetcher up with the PREFETCH_TRACKS songs after the entry being
+    played (from the start of the queue before anything plays), wrapping around
+    like the player does. Songs that dropped out of that window are cancelled or,
+    if already fetched and still unplayed, evicted so they stop counting against
+    the budget. The song being played is kept: the request it was prefetched for
+    may not have been served yet.
+    """
+    queue = queues.get(GLOBAL_QUEUE_ID, [])
+    current = next((i for i, song in enumerate(queue) if song["id"] == now_playing_id), None)
+    if current is None:
+        upcoming = queue
+        keep = set()
+    else:
+        upcoming = queue[current + 1:] + queue[:current]
+        keep = {queue[current].get("song_id")}
+    wanted = []
+    for song in upcoming:
+        song_id = song.get("song_id")
+        if song_id and song_id not in wanted:
+            wanted.append(song_id)
+        if len(wanted) >= PREFETCH_TRACKS:
+            break
+
+    keep.update(wanted)
+    for song_id, task in list(prefetch_tasks.items()):
+        if song_id not in keep:
+            task.cancel()
+            prefetch_tasks.pop(song_id, None)
+    for song_id in list(prefetched_ids):
+        if song_id not in keep:
+            prefetched_ids.discard(song_id)
+            audio_cache_discard(song_id)
+
+    for song_id in wanted:
+        if song_id not in prefetch_tasks and song_id not in audio_cache:
+            prefetch_tasks[song_id] = asyncio.create_task(prefetch_song(song_id))
+
+def audio_url(song_id) -> str:
+    """Stable, cacheable URL for a stored song."""
+    return f"/audio/{song_id}"
+
+def etag_matches(header_value: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our strong ETag."""
+    if not header_value:
+        return False
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+def parse_range(header_value: str, total: int):
+    """
+    Parses a single 'bytes=' range. Returns (start, end) inclusive, None when the
+    header should be ignored (malformed or multi-range), or raises 416.
+    """
+    match = RANGE_HEADER_RE.match(header_value.strip())
+    if not match:
+        return None
+    start_str, end_str = match.groups()
+    if not start_str and not end_str:
+        return None
+    if not start_str:
+        # Suffix range: the last N bytes
+        length = int(end_str)
+        if length == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+        return max(total - length, 0), total - 1
+    start = int(start_str)
+    end = int(end_str) if end_str else total - 1
+    if start >= total or end < start:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+    return start, min(end, total - 1)
+
+def queue_snapshot_event() -> dict:
+    # Copy now: the event is serialized later, and by then the live list may
+    # already hold songs that the following events add again
+    queue = [dict(song) for song in queues.get(GLOBAL_QUEUE_ID, [])]
+    return {"version": queue_version, "type": "snapshot", "queue": queue}
+
+def publish_queue_event(change: dict):
+    """
+    Stamps a queue change with the next version and fans it out to subscribers.
+    A subscriber that has fallen QUEUE_EVENT_BUFFER events behind has its backlog
+    replaced by a fresh snapshot instead of blocking everyone else.
+    """
+    global queue_version
+    queue_version += 1
+    event = {"version": queue_version, **change}
+    snapshot = None
+    for subscriber in queue_subscribers:
+        try:
+            subscriber.put_nowait(event)
+        except asyncio.QueueFull:
+            while not subscriber.empty():
+                subscriber.get_nowait()
+            if snapshot is None:
+                snapshot = queue_snapshot_event()
+            subscriber.put_nowait(snapshot)
+    schedule_prefetch()
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['version']}\ndata: {json.dumps(event)}\n\n"
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set NMUSIC_ADMIN_TOKEN")
+    if request.headers.get("authorization") != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+class _ThreadError:
+    def __init__(self, error: Exception):
+        self.error = error
+
+async def iterate_in_thread(make_iterator, stop: threading.Event, max_pending: int = 2):
+    """
+    Runs a blocking iterator on a dedicated thread (so one libsql connection is
+    only ever used from one thread) and yields its items on the event loop. The
+    bounded handoff queue gives backpressure; setting stop lets the thread exit
+    when the consumer goes away.
+    """
+    loop = asyncio.get_running_loop()
+    items: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    done = object()
+
+    def handoff(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(items.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def run():
+        try:
+            for item in make_iterator():
+                if not handoff(item):
+                    return
+            handoff(done)
+        except Exception as e:
+            handoff(_ThreadError(e))
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = await items.get()
+            if item is done:
+                return
+            if isinstance(item, _ThreadError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+class RequestBodyReader(io.RawIOBase):
+    """
+    Blocking, read-only file object over a request body for code that needs a
+    real file (tarfile). feed_request_body() pushes chunks through a small
+    bounded queue, so a slow reader slows the upload instead of buffering it.
+    """
+
+    def __init__(self, stop: threading.Event, max_chunks: int = 4):
+        self.chunks: queue.Queue = queue.Queue(maxsize=max_chunks)
+        self.stop = stop
+        self.current = memoryview(b"")
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self.current) and not self.finished:
+            try:
+                chunk = self.chunks.get(timeout=0.5)
+            except queue.Empty:
+                if self.stop.is_set():
+                    self.finished = True
+                continue
+            if chunk is None:
+                self.finished = True
+            else:
+                self.current = memoryview(chunk)
+        n = min(len(b), len(self.current))
+        b[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+async def feed_request_body(request: Request, reader: RequestBodyReader):
+    def put(item) -> bool:
+        while not reader.stop.is_set():
+            try:
+                reader.chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        async for chunk in request.stream():
+            if chunk and not await asyncio.to_thread(put, chunk):
+                return
+    finally:
+        await asyncio.to_thread(put, None)
+
+def audio_media_type(audio: bytes) -> str:
+    return "audio/ogg" if audio[:4] == b"OggS" else "audio/mpeg"
+
+def looks_like_audio(head: bytes) -> bool:
+    """MP3 (ID3 tag or MPEG frame sync) or Ogg (Opus/Vorbis) magic bytes."""
+    if head[:3] == b"ID3" or head[:4] == b"OggS":
+        return True
+    return len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0
+
+async def limited_stream(stream, limit: int):
+    """Passes a request body through, failing with 413 once it exceeds limit bytes."""
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {limit / (1024 * 1024):g} MB limit")
+        yield chunk
+
+class AudioSpool:
+    """
+    Hashes and zlib-compresses an upload chunk by chunk into a temporary file,
+    so only one chunk is in memory while the body is being received.
+    """
+
+    def __init__(self, level: int):
+        self.hasher = hashlib.sha256()
+        self.compressor = zlib.compressobj(level)
+        self.level = level
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.head = b""
+
+    def write(self, chunk: bytes):
+        if len(self.head) < 4:
+            self.head += chunk[:4 - len(self.head)]
+        self.size += len(chunk)
+        self.hasher.update(chunk)
+        self.file.write(self.compressor.compress(chunk))
+
+    def finish(self) -> int:
+        """Flushes the compressor and returns the stored (compressed) size."""
+        self.file.write(self.compressor.flush())
+        return self.file.tell()
+
+    def read(self) -> bytes:
+        # libsql only binds BLOBs as bytes and has no incremental BLOB writes, so
+        # the row is inserted in one piece: this copy plus the one libsql binds
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+def store_upload(spool: AudioSpool, title: str, content_hash: str):
+    """
+    Inserts an uploaded song unless the same audio is already stored, on its own
+    connection for use from a worker thread. Returns (song_id, existing_title),
+    existing_title being None for a new song. Rows ingested before hashes were
+    stored are only recognised once the startup backfill has reached them.
+    """
+    with get_db_connection() as conn:
+        ensure_library_table(conn)
+        ensure_audio_schema(conn)
+        existing = conn.execute(
+            "SELECT id, title FROM youtube_audio WHERE content_hash = ? LIMIT 1",
+            (content_hash,)
+        ).fetchall()
+        if existing:
+            return existing[0][0], existing[0][1]
+        cursor = conn.execute(
+            "INSERT INTO youtube_audio (title, audio_data, content_hash, compression) VALUES (?, ?, ?, ?)",
+            (title, spool.read(), content_hash, f"zlib-{spool.level}")
+        )
+        song_id = cursor.lastrowid
+        conn.commit()
+        return song_id, None
+
+def backfill_hashes_at_startup(stop: threading.Event):
+    """
+    Hashes rows stored without a content hash, in small paused batches on a
+    worker thread, so duplicate checks by hash (/upload) see the whole library.
+    Once a library is fully hashed this is a single empty query.
+    """
+    try:
+        with get_db_connection() as conn:
+            done = backfill_hashes(conn, pause=HASH_BACKFILL_PAUSE, stop=stop)
+        if done:
+            print(f"Hash backfill visited {done} rows")
+    except Exception as e:
+        print(f"Hash backfill failed: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: No specific startup tasks needed
+    # Startup: make sure the content hash column used for ETags exists
+    try:
+        with get_db_connection() as conn:
+            if not TURSO_DB_URL:
+                # A plain local file: WAL lets listeners keep reading while
+                # imports and uploads write from worker threads (persistent,
+                # so this only changes anything the first time)
+                conn.executescript("PRAGMA journal_mode=WAL;")
+            ensure_audio_schema(conn)
+    except Exception as e:
+        print(f"Schema check failed: {e}")
+    backfill_stop = threading.Event()
+    threading.Thread(target=backfill_hashes_at_startup, args=(backfill_stop,), daemon=True).start()
     yield
-    # Shutdown: Clean up temporary files
+    # Shutdown: stop the hash backfill and background prefetches, then clean up
+    # temporary files
+    backfill_stop.set()
+    for task in list(prefetch_tasks.values()):
+        task.cancel()
     for temp_file in temp_files:
         try:
             if os.path.exists(temp_file):
@@ -58,6 +698,8 @@ app.add_middleware(
 class Song(BaseModel):
     id: str
     name: str
+    song_id: Optional[int] = None
+    url: Optional[str] = None
 
 class AddSongRequest(BaseModel):
     name: str
@@ -68,26 +710,73 @@ class QueueResponse(BaseModel):
 class ReorderQueueRequest(BaseModel):
     order: List[str] # List of song IDs representing the new order
 
+class NowPlayingRequest(BaseModel):
+    id: str # queue entry id
+
+class QueueOperation(BaseModel):
+    op: Literal["add", "remove", "move"]
+    name: Optional[str] = None   # add: song name to search for
+    id: Optional[str] = None     # remove/move: queue entry id
+    index: Optional[int] = None  # add/move: target position (default: end)
+
+class BatchQueueRequest(BaseModel):
+    operations: List[QueueOperation]
+
 @app.get("/")
 async def root():
     return {
         "message": "Welcome to the Audio Database API",
         "endpoints": {
             "/play/{song_name}": "GET - Stream audio from database",
+            "/audio/{song_id}": "GET - Cacheable audio by song id (ETag, Range)",
             "/queue/add": "POST - Add a song to the queue",
             "/queue": "GET - Get the current queue",
             "/queue/{song_id}": "DELETE - Remove a song from the queue",
             "/queue/clear": "POST - Clear the queue",
-            "/queue/reorder": "POST - Reorder songs in the queue"
+            "/queue/reorder": "POST - Reorder songs in the queue",
+            "/queue/batch": "POST - Apply many add/remove/move operations atomically",
+            "/queue/events": "GET - Server-Sent Events feed of queue snapshots and changes",
+            "/queue/playing": "POST - Report the queue entry being played (steers prefetching)",
+            "/warmup": "GET - Sync the database and prime caches after a cold start",
+            "/limits": "GET - Admission control state per endpoint class",
+            "/library/export": "GET - Stream the whole library as a tar archive (admin)",
+            "/library/import": "POST - Import a library archive, skipping songs already present (admin)",
+            "/upload": "POST - Upload an MP3/Opus file as raw body or multipart 'file' field (admin)"
         }
     }
 
+def audio_response(request: Request, title: str, content_hash: str, audio: bytes,
+                   cache_control: str = AUDIO_CACHE_CONTROL) -> Response:
+    """In-memory audio response with ETag, If-None-Match and Range/If-Range handling."""
+    etag = f'"{content_hash}"'
+    cache_headers = {"Cache-Control": cache_control, "Accept-Ranges": "bytes", "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    headers = {
+        **cache_headers,
+        "Content-Disposition": f"inline; filename*=utf-8''{quote(title)}.mp3",
+        "X-Song-Title": quote(title),
+    }
+    total = len(audio)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range uses strong comparison: a stale validator means send everything
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range(range_header, total)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+            return Response(audio[start:end + 1], status_code=206, media_type=audio_media_type(audio), headers=headers)
+
+    return Response(audio, media_type=audio_media_type(audio), headers=headers)
+
 @app.get("/play/{song_name}")
-async def play_audio(song_name: str):
+async def play_audio(song_name: str, request: Request):
     try:
-        with libsql.connect("nmusic.db", sync_url=TURSO_DB_URL, auth_token=TURSO_AUTH_TOKEN) as conn:
+        with get_db_connection() as conn:
             result_set = conn.execute(
-                "SELECT title, audio_data FROM youtube_audio WHERE title LIKE ? ORDER BY created_at DESC LIMIT 1",
+                "SELECT id, title, length(audio_data) FROM youtube_audio WHERE title LIKE ? ORDER BY created_at DESC LIMIT 1",
                 (f"%{song_name}%",)
             )
             row = result_set.fetchone()
@@ -95,40 +784,347 @@ async def play_audio(song_name: str):
             if not row:
                 raise HTTPException(status_code=404, detail="No audio found in the database")
 
-            title, compressed_audio = row
-            decompressed_audio = zlib.decompress(compressed_audio)
+            song_id, title, compressed_size = row
+            # Prefetched or recently played: serve straight from memory. Look it
+            # up before moving the play position on, which reshapes the window
+            cached = audio_cache_get(song_id)
+            follow_playback(song_id)
+            if cached:
+                return audio_response(request, *cached, cache_control="no-cache")
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-                temp_file.write(decompressed_audio)
-                temp_file_path = temp_file.name
-                temp_files.append(temp_file_path)
+            # Shed load before touching the BLOB; the compressed and decompressed
+            # copies are alive at the same time
+            ticket = playback_limiter.acquire()
+            try:
+                ticket.reserve(2 * compressed_size)
+                compressed_audio = conn.execute(
+                    "SELECT audio_data FROM youtube_audio WHERE id = ?",
+                    (song_id,)
+                ).fetchone()[0]
+                decompressed_audio = zlib.decompress(compressed_audio)
 
-            return FileResponse(
-                temp_file_path,
-                media_type="audio/mpeg",
-                filename=f"{title}.mp3",
-                headers={"X-Song-Title": quote(title)}
-            )
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
+                    temp_file.write(decompressed_audio)
+                    temp_file_path = temp_file.name
+                    temp_files.append(temp_file_path)
+
+                return ticket.release_after(FileResponse(
+                    temp_file_path,
+                    media_type=audio_media_type(decompressed_audio),
+                    filename=f"{title}.mp3",
+                    headers={"X-Song-Title": quote(title)}
+                ))
+            finally:
+                ticket.close()
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Playback error: {str(e)}")
-    
+
+@app.get("/audio/{song_id}")
+async def get_audio(song_id: int, request: Request):
+    """
+    Serves a song by its database id. The bytes behind an id never change, so the
+    response carries an immutable Cache-Control, a strong ETag and Range support.
+    """
+    try:
+        cache_headers = {"Cache-Control": AUDIO_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+        cached = audio_cache_get(song_id)
+        follow_playback(song_id)
+        if cached:
+            return audio_response(request, *cached)
+
+        with get_db_connection() as conn:
+            row = conn.execute(
+                f"SELECT title, content_hash, length(audio_data) FROM youtube_audio WHERE {SONG_ID_MATCH}",
+                (song_id, song_id)
+            ).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="No audio found in the database")
+
+        # Revalidation can be answered without touching the BLOB
+        if row[1] and etag_matches(request.headers.get("if-none-match"), f'"{row[1]}"'):
+            return Response(status_code=304, headers={**cache_headers, "ETag": f'"{row[1]}"'})
+
+        ticket = playback_limiter.acquire()
+        try:
+            ticket.reserve(2 * row[2])
+            # Decompress off the event loop so other listeners keep being served
+            song = await asyncio.to_thread(fetch_song_audio, song_id)
+            if not song:
+                raise HTTPException(status_code=404, detail="No audio found in the database")
+            audio_cache_put(song_id, *song)
+            return ticket.release_after(audio_response(request, *song))
+        finally:
+            ticket.close()
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Playback error: {str(e)}")
+
+@app.get("/warmup")
+async def warmup():
+    """
+    Called by pinger.py after a cold start: opens and syncs the database, checks
+    the schema and indexes, and loads the hottest tracks into the audio cache so
+    the first real listener doesn't pay for any of it. Returns per-phase timings.
+    """
+    global warmed_up
+    # Classified by uptime, not by warmed_up: an instance that has been serving
+    # listeners for hours is warm even if nothing has called /warmup yet
+    uptime = time.time() - PROCESS_STARTED
+    first_warmup = not warmed_up
+    timings = {}
+    try:
+        started = time.perf_counter()
+        with get_db_connection() as conn:
+            timings["connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+            phase = time.perf_counter()
+            if TURSO_DB_URL:
+                conn.sync()
+            timings["sync_ms"] = round((time.perf_counter() - phase) * 1000, 1)
+
+            phase = time.perf_counter()
+            ensure_audio_schema(conn)
+            timings["schema_ms"] = round((time.perf_counter() - phase) * 1000, 1)
+
+            # Hottest tracks: whatever is queued, then the most recently added
+            phase = time.perf_counter()
+            hot_ids = [song["song_id"] for song in queues.get(GLOBAL_QUEUE_ID, []) if song.get("song_id")]
+            hot_ids += [row[0] for row in conn.execute(
+                "SELECT id FROM youtube_audio ORDER BY id DESC LIMIT ?",
+                (WARMUP_TRACKS,)
+            ).fetchall()]
+            hot_ids = [song_id for song_id in list(dict.fromkeys(hot_ids))[:WARMUP_TRACKS] if not audio_cache_get(song_id)]
+            sizes, unhashed = {}, set()
+            if hot_ids:
+                placeholders = ", ".join("?" for _ in hot_ids)
+                for song_id, has_hash, size in conn.execute(
+                    f"SELECT id, content_hash IS NOT NULL, length(audio_data) FROM youtube_audio WHERE id IN ({placeholders})",
+                    tuple(hot_ids)
+                ).fetchall():
+                    sizes[song_id] = size
+                    if not has_hash:
+                        unhashed.add(song_id)
+            loaded = 0
+            shed = False
+            # Priming is background work: it takes an ingest slot, so it backs
+            # off while listeners are busy and is skipped when none is free
+            try:
+                ticket = ingest_limiter.acquire()
+            except HTTPException:
+                ticket, shed = None, True
+            try:
+                for song_id in hot_ids if ticket else []:
+                    if song_id not in sizes:
+                        continue
+                    try:
+                        ticket.reserve_peak(2 * sizes[song_id])
+                    except HTTPException:
+                        shed = True
+                        break
+                    # Decompress and hash off the event loop, as /audio does, so
+                    # listeners arriving during the warm-up aren't held up
+                    try:
+                        song = await asyncio.to_thread(fetch_song_audio, song_id)
+                    except zlib.error:
+                        # A corrupt row shouldn't fail the warm-up; /audio
+                        # reports it when the song is actually played
+                        continue
+                    if not song:
+                        continue
+                    if song_id in unhashed:
+                        # The write stays on this thread; see fetch_song_audio
+                        conn.execute("UPDATE youtube_audio SET content_hash = ? WHERE id = ?", (song[1], song_id))
+                        conn.commit()
+                    audio_cache_put(song_id, *song)
+                    loaded += 1
+            finally:
+                if ticket:
+                    ticket.close()
+            timings["tracks_ms"] = round((time.perf_counter() - phase) * 1000, 1)
+
+        warmed_up = True
+        return {
+            "cold": uptime < COLD_START_SECONDS,
+            "first_warmup": first_warmup,
+            "uptime_s": round(uptime, 1),
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "timings": timings,
+            "tracks_loaded": loaded,
+            "tracks_shed": shed,
+            "audio_cache_bytes": audio_cache_bytes,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Warm-up error: {str(e)}")
 
 # Add this to your main.py API file
 
+@app.get("/limits")
+async def get_limits():
+    """Admission control counters, for monitoring and load tests."""
+    return {
+        "playback": playback_limiter.snapshot(),
+        "ingest": ingest_limiter.snapshot(),
+        "audio_cache_bytes": audio_cache_bytes,
+        "retry_after": RETRY_AFTER_SECONDS,
+    }
+
+@app.get("/library/export")
+async def export_library(request: Request):
+    """
+    Streams every song as a tar archive (see library_archive.py), one song in
+    memory at a time. Runs as ingest-class work so it never starves playback.
+    """
+    require_admin(request)
+    ticket = ingest_limiter.acquire()
+    try:
+        with get_db_connection() as conn:
+            largest = conn.execute("SELECT MAX(length(audio_data)) FROM youtube_audio").fetchone()[0]
+        # The song being archived is held twice: as read and as tar output
+        ticket.reserve(2 * (largest or 0))
+
+        def archive_chunks():
+            with get_db_connection() as conn:
+                yield from iter_export(conn)
+
+        body = iterate_in_thread(archive_chunks, threading.Event())
+        return ticket.release_after(StreamingResponse(
+            ticket.release_when_done(body),
+            media_type="application/x-tar",
+            headers={"Content-Disposition": 'attachment; filename="nmusic-library.tar"'}
+        ))
+    finally:
+        ticket.close()
+
+@app.post("/library/import")
+async def import_library(request: Request):
+    """
+    Imports an archive streamed as the raw request body. Parsing, hash checks
+    and the inserts all run on a worker thread with its own connection, so
+    listeners aren't held up; each song is committed as soon as it arrives and
+    songs already present by content hash are skipped, so a failed upload can
+    simply be sent again.
+    """
+    require_admin(request)
+    ticket = ingest_limiter.acquire()
+    stop = threading.Event()
+    summary = {"imported": 0, "skipped": 0}
+    try:
+        reader = RequestBodyReader(stop)
+        feeder = asyncio.create_task(feed_request_body(request, reader))
+
+        def import_songs():
+            with get_db_connection() as conn:
+                ensure_library_table(conn)
+                ensure_audio_schema(conn)
+                # Rows ingested before content_hash existed must be hashed, or
+                # they would be imported again as new songs
+                backfill_hashes(conn)
+                for meta, compressed_audio in iter_archive_songs(reader):
+                    yield len(compressed_audio), import_song(conn, meta, compressed_audio)
+
+        try:
+            async for size, imported in iterate_in_thread(import_songs, stop, max_pending=1):
+                summary["imported" if imported else "skipped"] += 1
+                # One song is alive in the parser and one being inserted
+                ticket.reserve_peak(2 * size)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Import stopped after {summary['imported']} imported, {summary['skipped']} skipped: {e}"
+            )
+        await feeder
+        return summary
+    finally:
+        stop.set()
+        ticket.close()
+
+@app.post("/upload")
+async def upload_audio(request: Request, title: Optional[str] = None, compress: bool = True):
+    """
+    Adds a local MP3/Opus file to the library. The file is sent either as the raw
+    request body (title in the query string) or as the 'file' field of a
+    multipart form. It is hashed and compressed as it arrives and the next chunk
+    is only read once the previous one is processed, so a slow server slows the
+    client down instead of buffering. Files already in the library are not
+    stored twice.
+    """
+    require_admin(request)
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES / (1024 * 1024):g} MB limit")
+
+    ticket = ingest_limiter.acquire()
+    spool = AudioSpool(UPLOAD_ZLIB_LEVEL if compress else 0)
+    form = None
+    try:
+        body = limited_stream(request.stream(), UPLOAD_MAX_BYTES)
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            # Starlette spools the file part to disk; then it is read back in chunks
+            try:
+                form = await MultiPartParser(request.headers, body, max_files=1, max_fields=10).parse()
+            except MultiPartException as e:
+                raise HTTPException(status_code=400, detail=f"Invalid multipart body: {e.message}")
+            upload = form.get("file")
+            if not isinstance(upload, UploadFile):
+                raise HTTPException(status_code=400, detail="Expected the audio in a 'file' field")
+            title = title or form.get("title") or os.path.splitext(upload.filename or "")[0]
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                await asyncio.to_thread(spool.write, chunk)
+        else:
+            async for chunk in body:
+                await asyncio.to_thread(spool.write, chunk)
+
+        if not title:
+            raise HTTPException(status_code=400, detail="A title is required")
+        if not spool.size or not looks_like_audio(spool.head):
+            raise HTTPException(status_code=415, detail="Only MP3 and Ogg/Opus audio can be uploaded")
+
+        content_hash = spool.hasher.hexdigest()
+        stored_size = await asyncio.to_thread(spool.finish)
+        # Compression can add a little to already-compressed audio
+        if 2 * stored_size > ingest_limiter.memory_budget:
+            raise HTTPException(status_code=413, detail="Upload is too large to store within the ingest memory budget")
+        ticket.reserve(2 * stored_size)
+        song_id, existing_title = await asyncio.to_thread(store_upload, spool, title, content_hash)
+        if existing_title is not None:
+            return {"status": "exists", "song_id": song_id, "name": existing_title,
+                    "url": audio_url(song_id), "content_hash": content_hash}
+
+        return {
+            "status": "created",
+            "song_id": song_id,
+            "name": title,
+            "url": audio_url(song_id),
+            "content_hash": content_hash,
+            "size": spool.size,
+            "stored_size": stored_size,
+        }
+    finally:
+        spool.close()
+        if form:
+            await form.close()
+        ticket.close()
+
 @app.get("/playlist")
 async def get_playlist():
     """
     Fetch all unique song titles from the database to populate the playlist.
     """
     try:
-        with libsql.connect("nmusic.db", sync_url=TURSO_DB_URL, auth_token=TURSO_AUTH_TOKEN) as conn:
-            # Fetch all distinct titles
+        with get_db_connection() as conn:
+            # Fetch all distinct titles, keeping the newest row for each
             result_set = conn.execute(
-                "SELECT DISTINCT title FROM youtube_audio ORDER BY title ASC"
+                "SELECT MAX(id), title FROM youtube_audio GROUP BY title ORDER BY title ASC"
             )
-            songs = [{"name": row[0]} for row in result_set.fetchall()]
+            songs = [
+                {"name": row[1], "song_id": row[0], "url": audio_url(row[0])}
+                for row in result_set.fetchall()
+            ]
             return {"songs": songs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Playlist fetch error: {str(e)}")
@@ -140,20 +1136,21 @@ GLOBAL_QUEUE_ID = "global_queue"
 @app.post("/queue/add", response_model=Song)
 async def add_to_queue(request: AddSongRequest):
     try:
-        with libsql.connect("nmusic.db", sync_url=TURSO_DB_URL, auth_token=TURSO_AUTH_TOKEN) as conn:
+        with get_db_connection() as conn:
             result = conn.execute(
-                "SELECT title FROM youtube_audio WHERE title LIKE ? LIMIT 1",
+                "SELECT id, title FROM youtube_audio WHERE title LIKE ? LIMIT 1",
                 (f"%{request.name}%",)
             ).fetchone()
             if not result:
                 raise HTTPException(status_code=404, detail=f"Song '{request.name}' not found in database")
-            song_title = result[0]
+            song_id, song_title = result
 
         if GLOBAL_QUEUE_ID not in queues:
             queues[GLOBAL_QUEUE_ID] = []
 
-        new_song = {"id": str(uuid4()), "name": song_title}
+        new_song = {"id": str(uuid4()), "name": song_title, "song_id": song_id, "url": audio_url(song_id)}
         queues[GLOBAL_QUEUE_ID].append(new_song)
+        publish_queue_event({"type": "add", "song": new_song, "index": len(queues[GLOBAL_QUEUE_ID]) - 1})
         return new_song
     except HTTPException as e:
         raise e
@@ -165,6 +1162,50 @@ async def get_queue():
     queue_items = queues.get(GLOBAL_QUEUE_ID, [])
     return QueueResponse(queue=queue_items)
 
+@app.get("/queue/events")
+async def queue_events(request: Request):
+    """
+    Server-Sent Events feed. Sends a versioned snapshot first, then one event per
+    change (add/remove/move/reorder/clear). A gap in versions means resubscribe.
+    """
+    subscriber: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_EVENT_BUFFER)
+    subscriber.put_nowait(queue_snapshot_event())
+    queue_subscribers.add(subscriber)
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), timeout=QUEUE_EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            queue_subscribers.discard(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/queue/playing")
+async def report_now_playing(request: NowPlayingRequest):
+    """
+    Tells the server which queue entry the player is on, so prefetching follows
+    it even when the audio itself comes from the client's cache.
+    """
+    global now_playing_id
+    if not any(song["id"] == request.id for song in queues.get(GLOBAL_QUEUE_ID, [])):
+        raise HTTPException(status_code=404, detail="Song not found in queue")
+    if request.id != now_playing_id:
+        now_playing_id = request.id
+        schedule_prefetch()
+    return {"message": "Now playing updated"}
+
 @app.delete("/queue/{song_id}")
 async def remove_from_queue(song_id: str):
     try:
@@ -177,6 +1218,7 @@ async def remove_from_queue(song_id: str):
             raise HTTPException(status_code=404, detail="Song not found in queue")
 
         queues[GLOBAL_QUEUE_ID] = [s for s in queue if s["id"] != song_id]
+        publish_queue_event({"type": "remove", "id": song_id})
         return {"message": f"Removed '{song_to_remove['name']}' from queue"}
     except HTTPException as e:
         raise e
@@ -187,6 +1229,7 @@ async def remove_from_queue(song_id: str):
 async def clear_queue():
     if GLOBAL_QUEUE_ID in queues:
         queues[GLOBAL_QUEUE_ID].clear()
+    publish_queue_event({"type": "clear"})
     return {"message": "Queue cleared"}
 
 @app.post("/queue/reorder")
@@ -207,6 +1250,7 @@ async def reorder_queue(request: ReorderQueueRequest):
 
         new_queue = [song_map[song_id] for song_id in new_order_ids]
         queues[GLOBAL_QUEUE_ID] = new_queue
+        publish_queue_event({"type": "reorder", "order": new_order_ids})
 
         return {"message": "Queue reordered successfully", "queue": new_queue}
     except HTTPException as e:
@@ -214,6 +1258,83 @@ async def reorder_queue(request: ReorderQueueRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Queue reorder error: {str(e)}")
 
+def resolve_song_names(conn, names: List[str]) -> Dict[str, tuple]:
+    """
+    Resolves many search names in a single query. Each name gets the same match
+    /queue/add would pick; names without a match are left out of the result.
+    """
+    unique_names = list(dict.fromkeys(names))
+    if not unique_names:
+        return {}
+    values = ", ".join("(?, ?)" for _ in unique_names)
+    params = []
+    for pos, name in enumerate(unique_names):
+        params.extend([pos, f"%{name}%"])
+    rows = conn.execute(
+        f"""
+        WITH wanted(pos, pattern) AS (VALUES {values})
+        SELECT w.pos, a.id, a.title
+        FROM wanted w
+        JOIN youtube_audio a
+          ON a.id = (SELECT id FROM youtube_audio WHERE title LIKE w.pattern LIMIT 1)
+        """,
+        tuple(params)
+    ).fetchall()
+    return {unique_names[pos]: (song_id, title) for pos, song_id, title in rows}
+
+@app.post("/queue/batch", response_model=QueueResponse)
+async def batch_queue(request: BatchQueueRequest):
+    """
+    Applies a list of add/remove/move operations in order. Either every operation
+    succeeds and the new queue is returned, or the queue is left untouched.
+    """
+    try:
+        add_names = [op.name for op in request.operations if op.op == "add"]
+        if any(not name for name in add_names):
+            raise HTTPException(status_code=400, detail="Add operations require a name")
+        if any(not op.id for op in request.operations if op.op != "add"):
+            raise HTTPException(status_code=400, detail="Remove and move operations require an id")
+
+        resolved = {}
+        if add_names:
+            with get_db_connection() as conn:
+                resolved = resolve_song_names(conn, add_names)
+            missing = [name for name in add_names if name not in resolved]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Songs not found in database: {', '.join(missing)}")
+
+        # Work on a copy so a failing operation leaves the live queue unchanged
+        new_queue = list(queues.get(GLOBAL_QUEUE_ID, []))
+        changes = []
+        for position, operation in enumerate(request.operations):
+            if operation.op == "add":
+                song_id, song_title = resolved[operation.name]
+                new_song = {"id": str(uuid4()), "name": song_title, "song_id": song_id, "url": audio_url(song_id)}
+                index = len(new_queue) if operation.index is None else operation.index
+                new_queue.insert(index, new_song)
+                changes.append({"type": "add", "song": new_song, "index": new_queue.index(new_song)})
+                continue
+
+            current_index = next((i for i, song in enumerate(new_queue) if song["id"] == operation.id), None)
+            if current_index is None:
+                raise HTTPException(status_code=404, detail=f"Operation {position}: song not found in queue")
+            song = new_queue.pop(current_index)
+            if operation.op == "move":
+                index = len(new_queue) if operation.index is None else operation.index
+                new_queue.insert(index, song)
+                changes.append({"type": "move", "id": song["id"], "index": new_queue.index(song)})
+            else:
+                changes.append({"type": "remove", "id": song["id"]})
+
+        queues[GLOBAL_QUEUE_ID] = new_queue
+        for change in changes:
+            publish_queue_event(change)
+        return QueueResponse(queue=new_queue)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Queue batch error: {str(e)}")
+
 
 if __name__ == "__main__":
     if not TURSO_AUTH_TOKEN or TURSO_AUTH_TOKEN == "YOUR_AUTH_TOKEN_HERE":
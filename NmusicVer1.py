@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import yt_dlp
@@ -10,6 +11,58 @@ import pygame
 TURSO_DB_URL = os.environ.get("TURSO_DB_URL", "")
 TURSO_AUTH_TOKEN = os.environ.get("TURSO_AUTH_TOKEN", "")
 
+class ZlibAudioStream(io.RawIOBase):
+    """
+    Read-only, seekable file object over zlib-compressed audio. Data is inflated
+    chunk by chunk as pygame reads it, so playback starts before the whole song
+    is decompressed and nothing is written to disk.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, compressed_audio):
+        self._source = memoryview(compressed_audio)
+        self._source_pos = 0
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _fill(self, size):
+        # Inflate more input until `size` bytes are buffered or the stream ends
+        while len(self._buffer) < size and not self._decompressor.eof:
+            chunk = self._source[self._source_pos:self._source_pos + self.CHUNK_SIZE]
+            if not chunk:
+                self._buffer += self._decompressor.flush()
+                break
+            self._source_pos += len(chunk)
+            self._buffer += self._decompressor.decompress(chunk)
+
+    def readinto(self, b):
+        self._fill(self._pos + len(b))
+        data = self._buffer[self._pos:self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            self._fill(sys.maxsize)
+            base = len(self._buffer)
+        elif whence == io.SEEK_CUR:
+            base = self._pos
+        else:
+            base = 0
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
 
 def fetch_and_play_audio(query):
     """
@@ -34,20 +87,14 @@ def fetch_and_play_audio(query):
             title, compressed_audio = row
             print(f"Retrieved '{title}' from the database.")
 
-            # Decompress the audio data
-            print("Decompressing audio data...")
-            decompressed_audio = zlib.decompress(compressed_audio)
-
             # --- PLAY AUDIO ---
-            # Save the decompressed audio to a temporary file to play it
-            temp_audio_path = f"temp_{title.replace(' ', '_')}.mp3"
-            with open(temp_audio_path, 'wb') as audio_file:
-                audio_file.write(decompressed_audio)
+            # Stream straight from memory; the stream decompresses as pygame reads
+            audio_stream = ZlibAudioStream(compressed_audio)
 
             # Initialize pygame mixer and play the audio
             pygame.init()
             pygame.mixer.init()
-            pygame.mixer.music.load(temp_audio_path)
+            pygame.mixer.music.load(audio_stream, "mp3")
             print(f"\n▶️ Now playing: {title}")
             pygame.mixer.music.play()
 
@@ -61,13 +108,11 @@ def fetch_and_play_audio(query):
         print(f"\nAn error occurred: {e}")
 
     finally:
-        # Clean up the temporary file
-        if 'temp_audio_path' in locals() and os.path.exists(temp_audio_path):
-            # Ensure the mixer is stopped before deleting the file
+        # Stop the mixer before the in-memory stream goes away
+        if pygame.mixer.get_init():
             pygame.mixer.music.stop()
+            pygame.mixer.music.unload()
             pygame.quit()
-            os.remove(temp_audio_path)
-            print(f"Cleaned up temporary file: {temp_audio_path}")
 
 def download_audio_from_youtube(video_url, output_path='.'):
     """
@@ -1,5 +1,6 @@
-const CACHE_NAME = 'nmusic-player-v6'; // Incremented version
+const CACHE_NAME = 'nmusic-player-v9'; // Incremented version
 const API_CACHE_NAME = 'nmusic-api-cache-v1';
+const AUDIO_CACHE_NAME = 'nmusic-audio-cache-v1';
 const urlsToCache = [
                   '/',
                   '/index.html',
@@ -20,8 +21,24 @@ self.addEventListener('fetch', event => {
     if (method !== 'GET') return;
 
     if (url.includes('nmusic.onrender.com')) {
-        if (url.includes('/play/')) {
-            return; // Do not cache streaming audio
+        if (url.includes('/play/') || url.includes('/queue/events')) {
+            return; // Do not cache streaming audio or the queue change feed
+        }
+        if (url.includes('/audio/')) {
+            // /audio/{id} is immutable: serve from cache, otherwise fetch the whole
+            // file once (no Range, the Cache API rejects 206) and keep it.
+            event.respondWith(
+                caches.open(AUDIO_CACHE_NAME).then(cache => {
+                    return cache.match(url).then(cached => {
+                        if (cached) return cached;
+                        return fetch(url).then(networkResponse => {
+                            if (networkResponse.status === 200) cache.put(url, networkResponse.clone());
+                            return networkResponse;
+                        });
+                    });
+                })
+            );
+            return;
         }
         event.respondWith(
             caches.open(API_CACHE_NAME).then(cache => {
@@ -40,7 +57,7 @@ event.respondWith(
 });
 
 self.addEventListener('activate', event => {
-    const cacheWhitelist = [CACHE_NAME, API_CACHE_NAME];
+    const cacheWhitelist = [CACHE_NAME, API_CACHE_NAME, AUDIO_CACHE_NAME];
     event.waitUntil(
     caches.keys().then(cacheNames => {
         return Promise.all(
@@ -2,11 +2,13 @@
 from flask import Flask, request, render_template, jsonify, Response
 import yt_dlp
 import zlib
+import hashlib
 import os
 # from pydub import AudioSegment <-- REMOVED
 import io
 from libsql import connect
 import base64
+import threading
 from functools import wraps
 
 app = Flask(__name__,template_folder="templates")
@@ -19,6 +21,36 @@ PASSWORD = "secret123"
 TURSO_DB_URL = ""
 TURSO_AUTH_TOKEN = ""
 
+# Admission control: downloads and transcodes are heavy, so only a few may run
+# at once. Extra requests get an immediate 503 with Retry-After instead of
+# queueing up and starving the player API of memory.
+INGEST_MAX_CONCURRENT = int(os.environ.get("NMUSIC_INGEST_MAX_CONCURRENT", "1"))
+RETRY_AFTER_SECONDS = int(os.environ.get("NMUSIC_INGEST_RETRY_AFTER", "30"))
+ingest_slots = threading.BoundedSemaphore(INGEST_MAX_CONCURRENT)
+ingest_stats = {"in_flight": 0, "admitted": 0, "rejected": 0}
+ingest_stats_lock = threading.Lock()
+
+def limit_ingest(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not ingest_slots.acquire(blocking=False):
+            with ingest_stats_lock:
+                ingest_stats["rejected"] += 1
+            response = jsonify({'status': 'busy', 'message': 'Another download is in progress, please retry shortly.'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response
+        with ingest_stats_lock:
+            ingest_stats["in_flight"] += 1
+            ingest_stats["admitted"] += 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            with ingest_stats_lock:
+                ingest_stats["in_flight"] -= 1
+            ingest_slots.release()
+    return decorated
+
 # Authentication decorator
 def check_auth(username, password):
     return username == USERNAME and password == PASSWORD
@@ -46,17 +78,27 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
             audio_data BLOB NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            content_hash TEXT,
+            source_id TEXT
         )
     """)
+    # Older databases predate content_hash (sha256 of the decompressed audio, the
+    # API's ETag) and source_id (the YouTube video id of each song)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(youtube_audio)").fetchall()]
+    for column in ("content_hash", "source_id"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE youtube_audio ADD COLUMN {column} TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_youtube_audio_content_hash ON youtube_audio (content_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_youtube_audio_source_id ON youtube_audio (source_id)")
     conn.commit()
     return conn
 
 # Download single audio from YouTube using yt-dlp
-def download_single_audio(youtube_url):
+def download_single_audio(youtube_url, file_stem='temp_audio'):
     ydl_opts = {
         'format': 'bestaudio/best',
-        'outtmpl': 'temp_audio.%(ext)s',
+        'outtmpl': f'{file_stem}.%(ext)s',
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': 'mp3',
@@ -66,23 +108,82 @@ def download_single_audio(youtube_url):
     }
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(youtube_url, download=True)
-        return 'temp_audio.mp3', info['title']
+        return f'{file_stem}.mp3', info['title'], info['id']
 
-# Download playlist from YouTube using yt-dlp
-def download_playlist(youtube_url):
+# List a playlist's entries without downloading or resolving any of them
+def list_playlist_entries(youtube_url):
     ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': 'temp_audio_%(playlist_index)s.%(ext)s',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
+        'extract_flat': 'in_playlist',
         'yes_playlist': True,
+        'quiet': True,
     }
+    # No ignoreerrors here: a bad URL must fail the request rather than come
+    # back as an empty playlist (unavailable videos fail per entry instead)
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(youtube_url, download=True)
-        return [(f"temp_audio_{i+1}.mp3", video['title']) for i, video in enumerate(info['entries'])]
+        info = ydl.extract_info(youtube_url, download=False)
+    if not info:
+        raise ValueError(f"Could not read playlist {youtube_url}.")
+    if info.get('entries') is None:
+        raise ValueError(f"{youtube_url} is not a playlist; use Single Song instead.")
+    entries = []
+    for entry in info['entries']:
+        if entry and entry.get('id'):
+            entries.append((entry['id'], entry.get('title'), entry.get('url') or entry['id']))
+    return entries
+
+# Video ids from source_ids that are already in the database
+def known_source_ids(conn, source_ids):
+    known = set()
+    for start in range(0, len(source_ids), 500):
+        batch = source_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        rows = conn.execute(
+            f"SELECT source_id FROM youtube_audio WHERE source_id IN ({placeholders})",
+            tuple(batch)
+        ).fetchall()
+        known.update(row[0] for row in rows)
+    return known
+
+# Songs added before source_id existed are matched by title once and tagged,
+# so later syncs can skip them by id
+def claim_by_title(conn, source_id, title):
+    if not title:
+        return False
+    row = conn.execute(
+        "SELECT id FROM youtube_audio WHERE title = ? AND source_id IS NULL LIMIT 1",
+        (title,)
+    ).fetchone()
+    if not row:
+        return False
+    conn.execute("UPDATE youtube_audio SET source_id = ? WHERE id = ?", (source_id, row[0]))
+    conn.commit()
+    return True
+
+# Sync a playlist: a flat pass lists the entries, songs already stored are
+# skipped by video id, and the rest are downloaded and inserted one at a time.
+# A failing entry is reported and the sync moves on; since every song is
+# committed as soon as it is inserted, an interrupted sync resumes on re-run.
+def download_playlist(conn, youtube_url):
+    entries = list_playlist_entries(youtube_url)
+    known = known_source_ids(conn, [source_id for source_id, _, _ in entries])
+    results = []
+    for source_id, title, url in entries:
+        if source_id in known or claim_by_title(conn, source_id, title):
+            results.append({'video_id': source_id, 'title': title, 'status': 'skipped', 'message': 'Already in the database.'})
+            continue
+        known.add(source_id)  # playlists can list a video twice
+        file_path = f"temp_audio_{source_id}.mp3"
+        try:
+            file_path, title, _ = download_single_audio(url, f"temp_audio_{source_id}")
+            compressed_data, content_hash = read_and_compress_audio(file_path)
+            success, message = insert_song(conn, title, compressed_data, content_hash, source_id)
+            results.append({'video_id': source_id, 'title': title, 'status': 'inserted' if success else 'skipped', 'message': message})
+        except Exception as e:
+            results.append({'video_id': source_id, 'title': title, 'status': 'failed', 'message': str(e)})
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    return results
 
 # --- CHANGE 2: Replace the pydub function with a simpler one ---
 # This new function reads the file's binary content directly and compresses it.
@@ -90,20 +191,26 @@ def read_and_compress_audio(file_path):
     with open(file_path, 'rb') as f:
         audio_data = f.read()
     compressed_data = zlib.compress(audio_data)
-    return compressed_data
+    # Hash now, while the raw bytes are at hand, so the API can answer
+    # revalidations without reading the BLOB back
+    return compressed_data, hashlib.sha256(audio_data).hexdigest()
 
 # Insert song into Turso database if it doesn't already exist
-def insert_song(conn, title, compressed_data):
-    result = conn.execute(
-        "SELECT id FROM youtube_audio WHERE title = ?",
-        (title,)
-    )
-    if result.fetchone():
-        return False, f"Song '{title}' already exists in the database."
+def insert_song(conn, title, compressed_data, content_hash, source_id=None):
+    # A known video id is the identity: different videos may share a title, and
+    # a same-titled row from before source_id existed is claimed, not duplicated
+    if source_id:
+        result = conn.execute("SELECT id FROM youtube_audio WHERE source_id = ?", (source_id,))
+        if result.fetchone() or claim_by_title(conn, source_id, title):
+            return False, f"Song '{title}' already exists in the database."
+    else:
+        result = conn.execute("SELECT id FROM youtube_audio WHERE title = ?", (title,))
+        if result.fetchone():
+            return False, f"Song '{title}' already exists in the database."
     
     conn.execute(
-        "INSERT INTO youtube_audio (title, audio_data) VALUES (?, ?);",
-        (title, compressed_data)
+        "INSERT INTO youtube_audio (title, audio_data, content_hash, source_id) VALUES (?, ?, ?, ?);",
+        (title, compressed_data, content_hash, source_id)
     )
     conn.commit()
     return True, f"Inserted song '{title}' into database."
@@ -127,8 +234,15 @@ def fetch_recent_song(conn, query):
 def index():
     return render_template('index.html')
 
+@app.route('/limits')
+@requires_auth
+def limits():
+    with ingest_stats_lock:
+        return jsonify({**ingest_stats, 'max_concurrent': INGEST_MAX_CONCURRENT, 'retry_after': RETRY_AFTER_SECONDS})
+
 @app.route('/process_audio', methods=['POST'])
 @requires_auth
+@limit_ingest
 def process_audio():
     youtube_url = request.form['youtube_url']
     download_type = request.form['download_type']
@@ -137,11 +251,11 @@ def process_audio():
     files_to_delete = []
     try:
         if download_type == 'single':
-            file_path, title = download_single_audio(youtube_url)
-            # --- CHANGE 3: Call the new function ---
-            compressed_data = read_and_compress_audio(file_path)
-            success, message = insert_song(conn, title, compressed_data)
+            file_path, title, source_id = download_single_audio(youtube_url)
             files_to_delete = [file_path]
+            # --- CHANGE 3: Call the new function ---
+            compressed_data, content_hash = read_and_compress_audio(file_path)
+            success, message = insert_song(conn, title, compressed_data, content_hash, source_id)
             if not success:
                 return jsonify({
                     'status': 'skipped', 'message': message,
@@ -149,17 +263,16 @@ def process_audio():
                 })
             fetched_title, audio_data = fetch_recent_song(conn, title)
         else:
-            audio_files = download_playlist(youtube_url)
-            titles = []
-            for file_path, title in audio_files:
-                # --- CHANGE 4: Call the new function in the loop ---
-                compressed_data = read_and_compress_audio(file_path)
-                success, msg = insert_song(conn, title, compressed_data)
-                files_to_delete.append(file_path)
-                if success:
-                    titles.append(title)
-            message = f"Inserted {len(titles)} new songs from playlist: {', '.join(titles)}" if titles else "No new songs inserted; all songs already exist."
-            fetched_title, audio_data = fetch_recent_song(conn, titles[0] if titles else "")
+            # Downloads, inserts and cleans up entry by entry
+            results = download_playlist(conn, youtube_url)
+            titles = [r['title'] for r in results if r['status'] == 'inserted']
+            failed = sum(1 for r in results if r['status'] == 'failed')
+            skipped = sum(1 for r in results if r['status'] == 'skipped')
+            message = f"Inserted {len(titles)} new songs from playlist: {', '.join(titles)}" if titles else "No new songs inserted."
+            message += f" Skipped {skipped} already in the database."
+            if failed:
+                message += f" {failed} failed."
+            fetched_title, audio_data = fetch_recent_song(conn, titles[0]) if titles else (None, None)
 
         response = {
             'status': 'success',
@@ -167,6 +280,8 @@ def process_audio():
             'fetched_title': fetched_title,
             'audio_data': base64.b64encode(audio_data).decode('utf-8') if audio_data else None
         }
+        if download_type != 'single':
+            response['results'] = results
     except Exception as e:
         response = { 'status': 'error', 'message': f"An error occurred: {str(e)}" }
     finally:
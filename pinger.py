@@ -1,14 +1,55 @@
 import requests
 import os
 import sys
+import json
 import time
 import random
 from datetime import datetime, time as dt_time
+from urllib.parse import urljoin
+
+# Every ping is appended here; the workflow caches the file between runs
+HISTORY_FILE = os.environ.get("PING_HISTORY_FILE", "ping_history.jsonl")
+# Upper bounds (seconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 90]
 
 def is_time_in_range(start, end, current):
     """Checks if a time is within a given range."""
     return start <= current <= end
 
+def record_ping(entry):
+    """Appends one ping result to the history file."""
+    with open(HISTORY_FILE, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+def load_history():
+    if not os.path.exists(HISTORY_FILE):
+        return []
+    with open(HISTORY_FILE) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def print_histogram(label, latencies):
+    """Prints a text histogram of response times in seconds."""
+    if not latencies:
+        return
+    latencies = sorted(latencies)
+    median = latencies[len(latencies) // 2]
+    print(f"\n{label}: {len(latencies)} pings, median {median:.2f}s, max {latencies[-1]:.2f}s")
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for latency in latencies:
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if latency <= bound), len(HISTOGRAM_BUCKETS))
+        counts[index] += 1
+    widest = max(counts)
+    for i, count in enumerate(counts):
+        bucket = f"<= {HISTOGRAM_BUCKETS[i]}s" if i < len(HISTOGRAM_BUCKETS) else f">  {HISTOGRAM_BUCKETS[-1]}s"
+        bar = "#" * round(count / widest * 40) if count else ""
+        print(f"  {bucket:>8} | {bar} {count if count else ''}")
+
+def report_history():
+    """Summarises cold- versus warm-start latency across all recorded runs."""
+    history = [entry for entry in load_history() if entry.get("ok")]
+    print_histogram("Cold starts", [entry["elapsed_s"] for entry in history if entry.get("cold")])
+    print_histogram("Warm instance", [entry["elapsed_s"] for entry in history if not entry.get("cold")])
+
 def ping_api_with_schedule():
     """
     Checks if the current time is within the scheduled windows,
@@ -34,7 +75,7 @@ def ping_api_with_schedule():
 
     print(f"Current UTC time {utc_now.strftime('%H:%M:%S')} is within a scheduled window. Proceeding with ping.")
     
-    api_url = "https://nmusic.onrender.com/"
+    api_url = os.environ.get("API_URL", "https://nmusic.onrender.com/")
     if not api_url:
         print("ERROR: API_URL environment variable not set. Exiting.")
         sys.exit(1)
@@ -45,19 +86,35 @@ def ping_api_with_schedule():
     print(f"Waiting for {random_delay} seconds before pinging...")
     time.sleep(random_delay)
 
-    print(f"Pinging {api_url} to keep it alive...")
+    # /warmup syncs the database and primes the audio cache, not just the process
+    warmup_url = urljoin(api_url, "warmup")
+    print(f"Pinging {warmup_url} to keep it alive and warm...")
 
+    entry = {"timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z", "ok": False}
+    started = time.perf_counter()
     try:
-        response = requests.get(api_url, timeout=30)
+        # Render cold starts can take close to a minute
+        response = requests.get(warmup_url, timeout=90)
+        entry["elapsed_s"] = round(time.perf_counter() - started, 3)
+        entry["status"] = response.status_code
         if 200 <= response.status_code < 300:
-            print(f"  -> SUCCESS! Status Code: {response.status_code}")
+            body = response.json()
+            entry.update(ok=True, cold=body.get("cold"), server_ms=body.get("total_ms"), uptime_s=body.get("uptime_s"))
+            state = "cold start" if body.get("cold") else "warm"
+            print(f"  -> SUCCESS! Status Code: {response.status_code} in {entry['elapsed_s']:.2f}s ({state}, server {body.get('total_ms')} ms)")
         else:
             print(f"  -> WARNING! Received non-success status code: {response.status_code}")
-            
+
     except requests.exceptions.RequestException as e:
+        entry["elapsed_s"] = round(time.perf_counter() - started, 3)
+        entry["error"] = str(e)
+        record_ping(entry)
         print(f"  -> FAILED! An error occurred: {e}")
         sys.exit(1)
 
+    record_ping(entry)
+    report_history()
+
 if __name__ == "__main__":
     ping_api_with_schedule()
 